@@ -7,11 +7,16 @@ import uuid
 import time
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from main import retrieve_data, clear_index, ingest_data, chunk_video
+from main import retrieve_data, clear_index, ingest_data, chunk_video, chunk_video_ranges, lookup_chunks, invalidate_interval_index, prefetch_snippets
+from interval_index import parse_timestamp
+from tracing import span, request_scope, profiling_requested
 import inspect
 import server
 from collections import Counter
 import re
+import hmac
+import json
+import hashlib
 import requests
 
 app = FastAPI()
@@ -25,6 +30,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Root span per request; send "X-Profile: 1" (or set PROFILE_REQUESTS) to capture a cProfile of the request.
+# The event-loop profile also includes other coroutines running meanwhile; see tracing.RequestProfile
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with request_scope(
+        f"{request.method} {request.url.path}",
+        profile=profiling_requested(request.headers.get("x-profile")),
+    ) as record:
+        response = await call_next(request)
+        record["attributes"]["status_code"] = response.status_code
+    if "profile" in record["attributes"]:
+        response.headers["X-Profile-Path"] = record["attributes"]["profile"]
+    return response
+
 # In-memory job status store
 job_status = {}
 
@@ -34,26 +53,26 @@ def process_video(file_path, job_id):
     job_status[job_id] = "ready"
 
 def ingest_single_video(file_path):
-    from main import ragie
+    from main import ragie, status_poller
     file_name = os.path.basename(file_path)
-    with open(file_path, "rb") as f:
-        file_content = f.read()
-    response = ragie.documents.create(request={
-        "file": {
-            "file_name": file_name,
-            "content": file_content,
-        },
-        "mode": {
-            "video": "audio_video",
-            "audio": True
-        }
-    })
-    import time
-    while True:
-        res = ragie.documents.get(document_id=response.id)
-        if res.status == "ready":
-            break
-        time.sleep(2)
+    with span("ingest.file_read", file=file_name) as record:
+        with open(file_path, "rb") as f:
+            file_content = f.read()
+        record["attributes"]["bytes"] = len(file_content)
+    with span("ingest.upload", file=file_name):
+        response = ragie.documents.create(request={
+            "file": {
+                "file_name": file_name,
+                "content": file_content,
+            },
+            "mode": {
+                "video": "audio_video",
+                "audio": True
+            }
+        })
+    with span("ingest.poll", file=file_name, document_id=response.id):
+        status_poller.wait(response.id, document_name=file_name, file_size=len(file_content))
+    invalidate_interval_index(file_name)
 
 @app.post("/upload_video/")
 def upload_video(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
@@ -73,6 +92,26 @@ def upload_video(file: UploadFile = File(...), background_tasks: BackgroundTasks
         background_tasks.add_task(process_video, file_path, job_id)
     return {"message": "Video uploaded successfully", "filename": file.filename, "job_id": job_id}
 
+# Only this process receives Ragie webhooks, so only it relaxes polling to the webhook fallback
+if os.getenv("RAGIE_WEBHOOK", "").lower() in ("1", "true", "yes"):
+    from main import status_poller
+    status_poller.webhook = True
+
+@app.post("/webhooks/ragie")
+async def ragie_webhook(request: Request):
+    from main import status_poller
+    body = await request.body()
+    secret = os.getenv("RAGIE_WEBHOOK_SECRET")
+    if secret:
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, request.headers.get("x-signature", "")):
+            raise HTTPException(status_code=401, detail="Invalid webhook signature.")
+    event = json.loads(body)
+    if event.get("type") == "document_status_updated":
+        payload = event.get("payload", {})
+        status_poller.notify(payload.get("document_id"), payload.get("status"))
+    return {"ok": True}
+
 @app.get("/status/{job_id}")
 def get_status(job_id: str):
     status = job_status.get(job_id, "not_found")
@@ -85,8 +124,15 @@ async def query_video(request: Request):
         query = data.get("query")
         if not query:
             return {"answer": "No query provided.", "chunks": []}
-        chunks = retrieve_data(query)
+        chunks = retrieve_data(
+            query,
+            document_names=data.get("document_names"),
+            top_k=data.get("top_k"),
+            min_score=data.get("min_score"),
+            fields=data.get("fields"),
+        )
         if chunks and isinstance(chunks, list) and len(chunks) > 0:
+            prefetch_snippets(chunks, top_n=data.get("prefetch"))
             answer = chunks[0].get("text", "No answer found.")
             return {"answer": answer, "chunks": chunks}
         else:
@@ -100,6 +146,33 @@ async def get_video_snippet_post(request: Request):
     document_name = data.get("document_name")
     start_time = data.get("start_time")
     end_time = data.get("end_time")
+    ranges = data.get("ranges")
+    if document_name and ranges:
+        # Several ranges: render the minimal set of clips and return URLs to fetch them from
+        try:
+            parsed_ranges = [(float(start), float(end)) for start, end in ranges]
+            merge_gap = float(data.get("merge_gap", 1.0))
+            if merge_gap < 0 or any(start < 0 or end <= start for start, end in parsed_ranges):
+                raise ValueError("ranges need 0 <= start_time < end_time and merge_gap must be non-negative")
+        except (TypeError, ValueError) as e:
+            return JSONResponse({"error": f"Invalid ranges or merge_gap: {str(e)}"}, status_code=400)
+        try:
+            snippets = chunk_video_ranges(
+                document_name,
+                parsed_ranges,
+                merge=data.get("merge", True),
+                merge_gap=merge_gap,
+            )
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+        return {"snippets": [
+            {
+                "start_time": snippet["start_time"],
+                "end_time": snippet["end_time"],
+                "url": str(request.url_for("get_video_chunk", filename=os.path.basename(snippet["path"]))),
+            }
+            for snippet in snippets
+        ]}
     if not document_name or start_time is None or end_time is None:
         return JSONResponse({"error": "Missing required parameters."}, status_code=400)
     try:
@@ -108,6 +181,35 @@ async def get_video_snippet_post(request: Request):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/video_chunks/{filename}")
+def get_video_chunk(filename: str):
+    # Only serve rendered clips straight from video_chunks/, never paths outside it
+    if os.path.basename(filename) != filename or not filename.endswith(".mp4"):
+        raise HTTPException(status_code=400, detail="Invalid video chunk name.")
+    path = os.path.join("video_chunks", filename)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Video chunk not found.")
+    return FileResponse(path, media_type="video/mp4")
+
+@app.post("/lookup_timestamp/")
+async def lookup_timestamp_post(request: Request):
+    data = await request.json()
+    document_name = data.get("document_name")
+    timestamp = data.get("timestamp", data.get("start_time"))
+    if not document_name or timestamp is None:
+        return JSONResponse({"error": "Missing document_name or timestamp."}, status_code=400)
+    end_time = data.get("end_time")
+    try:
+        start = parse_timestamp(timestamp)
+        end = parse_timestamp(end_time) if end_time is not None else None
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        chunks = lookup_chunks(document_name, start, end)
+        return {"chunks": chunks}
+    except Exception as e:
+        return JSONResponse({"error": f"Failed to look up timestamp: {str(e)}"}, status_code=500)
+
 @app.post("/get_transcript/")
 async def get_transcript_post(request: Request):
     data = await request.json()
@@ -117,8 +219,9 @@ async def get_transcript_post(request: Request):
     try:
         # Get all chunks for this video
         from main import retrieve_data
-        chunks = retrieve_data(document_name)
-        transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
+        with span("transcript.assemble", chunks=len(chunks)):
+            transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
         return {"transcript": transcript}
     except Exception as e:
         return JSONResponse({"error": f"Failed to get transcript: {str(e)}"}, status_code=500)
@@ -131,7 +234,7 @@ async def get_highlights_post(request: Request):
         return JSONResponse({"error": "Missing document_name."}, status_code=400)
     try:
         from main import retrieve_data
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         # Take first 3 non-empty chunks as highlights
         highlights = [chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name and chunk.get("text")] \
             [:3]
@@ -148,7 +251,7 @@ async def translate_transcript_post(request: Request):
         return JSONResponse({"error": "Missing document_name or target_language."}, status_code=400)
     try:
         from main import retrieve_data
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
         # Use LibreTranslate public API
         response = requests.post(
@@ -177,23 +280,24 @@ async def get_analytics_post(request: Request):
         return JSONResponse({"error": "Missing document_name."}, status_code=400)
     try:
         from main import retrieve_data
-        chunks = retrieve_data(document_name)
-        chunk_texts = [c.get("text", "") for c in chunks if c.get("document_name") == document_name]
-        transcript = " ".join(chunk_texts)
-        words = re.findall(r"\w+", transcript.lower())
-        stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
-        non_stopwords = [w for w in words if w not in stopwords]
-        most_common_words = [w for w, _ in Counter(non_stopwords).most_common(5)]
-        num_highlights = min(3, len([t for t in chunk_texts if t]))
-        # Estimate duration: assume 150 words/minute
-        duration_min = round(len(words) / 150, 2) if words else 0
-        analytics = {
-            "num_chunks": len(chunk_texts),
-            "total_length": sum(len(t) for t in chunk_texts),
-            "duration_minutes": duration_min,
-            "most_common_words": most_common_words,
-            "num_highlights": num_highlights
-        }
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
+        with span("analytics", chunks=len(chunks)):
+            chunk_texts = [c.get("text", "") for c in chunks if c.get("document_name") == document_name]
+            transcript = " ".join(chunk_texts)
+            words = re.findall(r"\w+", transcript.lower())
+            stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
+            non_stopwords = [w for w in words if w not in stopwords]
+            most_common_words = [w for w, _ in Counter(non_stopwords).most_common(5)]
+            num_highlights = min(3, len([t for t in chunk_texts if t]))
+            # Estimate duration: assume 150 words/minute
+            duration_min = round(len(words) / 150, 2) if words else 0
+            analytics = {
+                "num_chunks": len(chunk_texts),
+                "total_length": sum(len(t) for t in chunk_texts),
+                "duration_minutes": duration_min,
+                "most_common_words": most_common_words,
+                "num_highlights": num_highlights
+            }
         return {"analytics": analytics}
     except Exception as e:
         return JSONResponse({"error": f"Failed to get analytics: {str(e)}"}, status_code=500)
@@ -214,7 +318,7 @@ async def get_tags_chapters_post(request: Request):
     try:
         from main import retrieve_data
         import collections
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         # Tags: most common words (excluding stopwords)
         import re
         stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
@@ -0,0 +1,117 @@
+import math
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center, by_start, by_end, left, right):
+        self.center = center
+        self.by_start = by_start
+        self.by_end = by_end
+        self.left = left
+        self.right = right
+
+
+def _build(entries: List[Tuple[float, float, int, Any]]) -> Optional[_Node]:
+    if not entries:
+        return None
+    # Centre on the median start so the node holds at least one interval and each side at most half
+    center = sorted(entry[0] for entry in entries)[len(entries) // 2]
+    here, left, right = [], [], []
+    for entry in entries:
+        if entry[1] < center:
+            left.append(entry)
+        elif entry[0] > center:
+            right.append(entry)
+        else:
+            here.append(entry)
+    return _Node(
+        center,
+        sorted(here, key=lambda entry: entry[0]),
+        sorted(here, key=lambda entry: entry[1], reverse=True),
+        _build(left),
+        _build(right),
+    )
+
+
+class IntervalIndex:
+    """
+    Static centred interval tree over (start, end, item) intervals.
+
+    Each node keeps the intervals containing its centre sorted by start and by end,
+    so a point or range lookup visits O(log n) nodes and only touches intervals it
+    returns; a long interval (e.g. a whole-video description) costs one node, not a
+    scan of everything after it.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[float, float, Any]]):
+        # The insertion order breaks ties so results come back sorted by start
+        entries = [(float(s), float(e), order, item) for order, (s, e, item) in enumerate(intervals)]
+        self._size = len(entries)
+        self._root = _build(entries)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def overlapping(self, start: float, end: Optional[float] = None) -> List[Any]:
+        """Return items whose interval overlaps [start, end] (or contains start if end is None), ordered by start."""
+        end = start if end is None else end
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if end < node.center:
+                # Every interval here ends at or after the centre, so only the start matters
+                for entry in node.by_start:
+                    if entry[0] > end:
+                        break
+                    found.append(entry)
+                stack.append(node.left)
+            elif start > node.center:
+                for entry in node.by_end:
+                    if entry[1] < start:
+                        break
+                    found.append(entry)
+                stack.append(node.right)
+            else:
+                found.extend(node.by_start)
+                stack.append(node.left)
+                stack.append(node.right)
+        found.sort(key=lambda entry: (entry[0], entry[2]))
+        return [entry[3] for entry in found]
+
+    def at(self, timestamp: float) -> List[Any]:
+        return self.overlapping(timestamp)
+
+
+def merge_ranges(ranges: Iterable[Tuple[float, float]], gap: float = 0.0) -> List[Tuple[float, float]]:
+    """Coalesce overlapping ranges, and ranges separated by at most `gap` seconds."""
+    merged = []
+    for start, end in sorted((float(s), float(e)) for s, e in ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_timestamp(value: Any) -> float:
+    """Accept seconds as a number or a "[hh:]mm:ss" string such as "12:30"; raise ValueError otherwise."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        parts = [float(value)]
+    else:
+        text = str(value).strip()
+        pieces = text.split(":")
+        if len(pieces) > 3:
+            raise ValueError(f"Invalid timestamp {text!r}: expected seconds or [hh:]mm:ss")
+        parts = [float(piece) for piece in pieces]
+    seconds = 0.0
+    for part in parts:
+        # Negative or non-finite parts would silently shift the time ("1:-30" -> 30.0)
+        if not math.isfinite(part) or part < 0:
+            raise ValueError(f"Invalid timestamp {value!r}: parts must be non-negative numbers")
+        seconds = seconds * 60 + part
+    return seconds
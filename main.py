@@ -1,21 +1,43 @@
 import os
-import time
+import re
+import json
+import hashlib
 import logging
+import tempfile
 from pathlib import Path
-from typing import Any
+from typing import Any, List, Optional
 
 from dotenv import load_dotenv
 from ragie import Ragie
 from moviepy import VideoFileClip
 
+from ragie_client import ResilientRagie
+from status_poller import DocumentStatusPoller
+from interval_index import IntervalIndex, merge_ranges
+from prefetch import SnippetPrefetcher, cpu_is_busy
+from tracing import span
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# initialize ragie client
-ragie = Ragie(
-    auth=os.getenv('RAGIE_API_KEY'),
+# initialize ragie client; every call goes through timeouts, retries and the circuit breaker
+ragie = ResilientRagie(
+    Ragie(
+        auth=os.getenv('RAGIE_API_KEY'),
+    ),
+    timeout_ms=int(os.getenv('RAGIE_TIMEOUT_MS', '60000')),
+    # Video uploads have no timeout unless RAGIE_UPLOAD_TIMEOUT_MS is set
+    upload_timeout_ms=int(os.environ['RAGIE_UPLOAD_TIMEOUT_MS']) if os.getenv('RAGIE_UPLOAD_TIMEOUT_MS') else None,
+    max_retries=int(os.getenv('RAGIE_MAX_RETRIES', '4')),
+)
+
+# One poller waits on every document Ragie is still processing; only the FastAPI backend,
+# which serves /webhooks/ragie, switches it to webhook mode
+status_poller = DocumentStatusPoller(
+    ragie,
+    timeout=float(os.getenv('RAGIE_INGEST_TIMEOUT', '1800')),
 )
 
 # Remove previous docs from index
@@ -40,6 +62,7 @@ def clear_index():
             # Check if there are more documents
             if not response.result.pagination.next_cursor:
                 logger.warning("No more documents\n")
+                invalidate_interval_index()
                 break
 
         except Exception as e:
@@ -51,56 +74,99 @@ def ingest_data(directory):
     # Get list of files in directory
     directory_path = Path(directory)
     files = os.listdir(directory_path)
-    
+    pending = {}
+
     for file in files:
         try:
             file_path = directory_path / file
             # Read file content
-            with open(file_path, mode='rb') as f:
-                file_content = f.read()   
+            with span("ingest.file_read", file=file) as record:
+                with open(file_path, mode='rb') as f:
+                    file_content = f.read()
+                record["attributes"]["bytes"] = len(file_content)
             # Create document in Ragie
-            response = ragie.documents.create(request={
-                "file": {
-                    "file_name": file,
-                    "content": file_content,
-                },
-                "mode": {
-                    "video": "audio_video",
-                    "audio": True
-                }
-            })
-            # Wait for document to be ready
-            while True:
-                res = ragie.documents.get(document_id=response.id)
-                if res.status == "ready":
-                    break
-        
-                time.sleep(2)
-
-            logger.info(f"Successfully uploaded {file}")
-            
+            with span("ingest.upload", file=file):
+                response = ragie.documents.create(request={
+                    "file": {
+                        "file_name": file,
+                        "content": file_content,
+                    },
+                    "mode": {
+                        "video": "audio_video",
+                        "audio": True
+                    }
+                })
+            # Hand the document to the shared poller and keep uploading
+            pending[file] = status_poller.track(response.id, document_name=file, file_size=len(file_content))
+
         except Exception as e:
             logger.error(f"Failed to process file {file}: {str(e)}")
             continue
 
+    # Wait for all documents to be ready
+    with span("ingest.poll", documents=len(pending)):
+        for file, future in pending.items():
+            try:
+                future.result()
+                invalidate_interval_index(file)
+                logger.info(f"Successfully uploaded {file}")
+            except Exception as e:
+                logger.error(f"Failed to process file {file}: {str(e)}")
+
+# Fields every retrieved chunk can be projected onto (document metadata keys are also allowed)
+CHUNK_FIELDS = ("text", "document_name", "document_id", "score", "start_time", "end_time")
+
+def _chunk_field(chunk, field):
+    if field in ("start_time", "end_time"):
+        return (chunk.metadata or {}).get(field)
+    if field in CHUNK_FIELDS:
+        return getattr(chunk, field)
+    return chunk.document_metadata.get(field)
+
+# Accept a bare string for list parameters coming from JSON/MCP; list("a.mp4") would split it into characters
+def _as_list(value, name):
+    if value is None or isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, tuple):
+        return list(value)
+    raise ValueError(f"{name} must be a list of strings, got {type(value).__name__}")
+
 # Retrieve data from the Ragie index
-def retrieve_data(query):
+def retrieve_data(query, document_names=None, top_k=None, min_score=None, fields=None):
     try:
         logger.info(f"Retrieving data for query: {query}")
-        retrieval_response = ragie.retrievals.retrieve(request={
-            "query": query
-        })
+        document_names = _as_list(document_names, "document_names")
+        fields = _as_list(fields, "fields")
+        request = {"query": query}
+        # Scope and size the retrieval server-side instead of discarding chunks afterwards;
+        # document_name is one of the metadata keys Ragie fills in itself
+        if document_names:
+            request["filter"] = {"document_name": {"$in": document_names}}
+        if top_k is not None:
+            request["top_k"] = top_k
+        with span("retrieval", top_k=top_k, document_names=document_names) as record:
+            retrieval_response = ragie.retrievals.retrieve(request=request)
+            record["attributes"]["chunks"] = len(retrieval_response.scored_chunks)
 
-        content = [
-            {
-                **chunk.document_metadata,
-                "text": chunk.text,
-                "document_name": chunk.document_name,
-                "start_time": chunk.metadata.get("start_time"),
-                "end_time": chunk.metadata.get("end_time")
-            }
-            for chunk in retrieval_response.scored_chunks
-        ]
+        scored_chunks = retrieval_response.scored_chunks
+        if min_score is not None:
+            scored_chunks = [chunk for chunk in scored_chunks if chunk.score >= min_score]
+
+        if fields:
+            content = [{field: _chunk_field(chunk, field) for field in fields} for chunk in scored_chunks]
+        else:
+            content = [
+                {
+                    **chunk.document_metadata,
+                    "text": chunk.text,
+                    "document_name": chunk.document_name,
+                    "start_time": (chunk.metadata or {}).get("start_time"),
+                    "end_time": (chunk.metadata or {}).get("end_time")
+                }
+                for chunk in scored_chunks
+            ]
 
         logger.info(f"Successfully retrieved {len(content)} chunks")
         return content
@@ -109,21 +175,184 @@ def retrieve_data(query):
         logger.error(f"Failed to retrieve data: {str(e)}")
         raise
 
+# Per-document interval indexes over chunk start/end times, built lazily
+_interval_indexes = {}
+
+def invalidate_interval_index(document_name=None):
+    if document_name is None:
+        _interval_indexes.clear()
+    else:
+        _interval_indexes.pop(document_name, None)
+
+def get_interval_index(document_name):
+    index = _interval_indexes.get(document_name)
+    if index is not None:
+        return index
+
+    response = ragie.documents.list(request={
+        "filter": json.dumps({"document_name": {"$eq": document_name}}),
+        "page_size": 1
+    })
+    documents = response.result.documents
+    if not documents:
+        raise ValueError(f"Document {document_name} not found in the index")
+
+    intervals = []
+    cursor = None
+    while True:
+        request = {"document_id": documents[0].id, "page_size": 100}
+        if cursor:
+            request["cursor"] = cursor
+        chunk_list = ragie.documents.get_chunks(request=request)
+        for chunk in chunk_list.chunks:
+            metadata = chunk.metadata or {}
+            if metadata.get("start_time") is None or metadata.get("end_time") is None:
+                continue
+            intervals.append((metadata["start_time"], metadata["end_time"], {
+                "text": chunk.text,
+                "document_name": document_name,
+                "start_time": metadata["start_time"],
+                "end_time": metadata["end_time"]
+            }))
+        cursor = chunk_list.pagination.next_cursor
+        if not cursor:
+            break
+
+    with span("interval_index.build", document_name=document_name, chunks=len(intervals)):
+        index = IntervalIndex(intervals)
+    _interval_indexes[document_name] = index
+    logger.info(f"Built interval index for {document_name} with {len(index)} chunks")
+    return index
+
+# Look up the chunks spoken/shown at a timestamp, or overlapping [start_time, end_time]
+def lookup_chunks(document_name, start_time, end_time=None):
+    return get_interval_index(document_name).overlapping(start_time, end_time)
+
+# The full document name plus a hash of it, so talk.mp4/talk.mov (or names differing only in sanitised characters) never share a file
+def _snippet_path(document_name, start_time, end_time):
+    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", document_name)
+    name_hash = hashlib.sha1(document_name.encode()).hexdigest()[:8]
+    return Path("video_chunks") / f"{safe_name}_{name_hash}_chunk_{start_time:.1f}_{end_time:.1f}.mp4"
+
+# A rendered snippet can be served as long as the source video has not been replaced since
+def _is_cached(output_path, source_path):
+    try:
+        return output_path.stat().st_mtime >= os.stat(source_path).st_mtime
+    except OSError:
+        return False
+
+def _write_subclip(video, start_time, end_time, output_path, threads=None):
+    video_duration = video.duration
+    if start_time >= video_duration:
+        raise ValueError(f"start_time ({start_time}) should be smaller than the clip's duration ({video_duration}).")
+    actual_end_time = min(end_time, video_duration) if end_time is not None else video_duration
+    video_chunk = video.subclipped(start_time, actual_end_time)
+    # Write under a unique temporary name so a half-written file is never served, and a
+    # foreground and a prefetch render of the same snippet never write the same file
+    with tempfile.NamedTemporaryFile(dir=output_path.parent, prefix=f"{output_path.stem}.", suffix=".part.mp4", delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        with span("snippet.encode", path=str(output_path), seconds=actual_end_time - start_time):
+            video_chunk.write_videofile(tmp_path, threads=threads)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _render_snippet(document_name, start_time, end_time, directory="videos", threads=None):
+    output_path = _snippet_path(document_name, start_time, end_time)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    source_path = directory + "/" + document_name
+    if _is_cached(output_path, source_path):
+        return output_path
+    with span("snippet.decode", document_name=document_name):
+        video = VideoFileClip(source_path)
+    with video:
+        _write_subclip(video, start_time, end_time, output_path, threads=threads)
+    return output_path
+
 def chunk_video(document_name, start_time, end_time, directory="videos"):
+    output_path = _snippet_path(document_name, start_time, end_time)
+    # Take over a speculative render of the same snippet instead of racing it
+    snippet_prefetcher.wait(str(output_path))
+    if _is_cached(output_path, directory + "/" + document_name):
+        logger.info(f"Serving cached video chunk {output_path}")
+        return output_path
+    return _render_snippet(document_name, start_time, end_time, directory)
+
+# Render several ranges of one video, coalescing overlapping or near-adjacent ones (within merge_gap seconds) first
+def chunk_video_ranges(document_name, ranges, merge=True, merge_gap=1.0, directory="videos"):
+    if merge:
+        ranges = merge_ranges(ranges, gap=merge_gap)
     output_dir = Path("video_chunks")
     output_dir.mkdir(parents=True, exist_ok=True)
-    chunk_filename = f"video_chunk_{start_time:.1f}_{end_time:.1f}.mp4"
-    output_path = output_dir / chunk_filename
+    source_path = directory + "/" + document_name
 
-    with VideoFileClip(directory + "/" + document_name) as video:
-        video_duration = video.duration
-        if start_time >= video_duration:
-            raise ValueError(f"start_time ({start_time}) should be smaller than the clip's duration ({video_duration}).")
-        actual_end_time = min(end_time, video_duration) if end_time is not None else video_duration
-        video_chunk = video.subclipped(start_time, actual_end_time)
-        video_chunk.write_videofile(str(output_path))
+    snippets = []
+    video = None
+    try:
+        for start_time, end_time in ranges:
+            output_path = _snippet_path(document_name, start_time, end_time)
+            snippet_prefetcher.wait(str(output_path))
+            if not _is_cached(output_path, source_path):
+                # Decode the source at most once for all clips
+                if video is None:
+                    with span("snippet.decode", document_name=document_name):
+                        video = VideoFileClip(source_path)
+                _write_subclip(video, start_time, end_time, output_path)
+            snippets.append({"start_time": start_time, "end_time": end_time, "path": str(output_path)})
+    finally:
+        if video is not None:
+            video.close()
 
-    return output_path
+    return snippets
+
+# Speculatively render snippets for the top retrieval results on the low-priority prefetch pool
+snippet_prefetcher = SnippetPrefetcher(max_workers=int(os.getenv('SNIPPET_PREFETCH_WORKERS', '1')))
+SNIPPET_PREFETCH_TOP_N = int(os.getenv('SNIPPET_PREFETCH_TOP_N', '0'))
+# CPU budget: seconds of footage rendered per retrieval, and the per-core load above which prefetching is skipped
+SNIPPET_PREFETCH_MAX_SECONDS = float(os.getenv('SNIPPET_PREFETCH_MAX_SECONDS', '120'))
+SNIPPET_PREFETCH_MAX_LOAD = float(os.getenv('SNIPPET_PREFETCH_MAX_LOAD', '0.75'))
+
+# Best effort: a bad prefetch parameter or scheduling error is logged and never fails the retrieval it follows
+def prefetch_snippets(chunks, top_n=None, directory="videos"):
+    try:
+        return _prefetch_snippets(chunks, top_n, directory)
+    except Exception as e:
+        logger.warning(f"Skipping snippet prefetch: {str(e)}")
+        return 0
+
+def _prefetch_snippets(chunks, top_n, directory):
+    top_n = SNIPPET_PREFETCH_TOP_N if top_n is None else int(top_n)
+    if top_n <= 0 or not isinstance(chunks, list):
+        return 0
+    if cpu_is_busy(SNIPPET_PREFETCH_MAX_LOAD):
+        logger.info("Skipping snippet prefetch, CPU is busy")
+        return 0
+
+    jobs = {}
+    budget = SNIPPET_PREFETCH_MAX_SECONDS
+    for chunk in chunks[:top_n]:
+        document_name = chunk.get("document_name")
+        start_time = chunk.get("start_time")
+        end_time = chunk.get("end_time")
+        if not document_name or start_time is None or end_time is None:
+            continue
+        start_time, end_time = float(start_time), float(end_time)
+        budget -= end_time - start_time
+        if budget < 0:
+            break
+        output_path = _snippet_path(document_name, start_time, end_time)
+        if not _is_cached(output_path, directory + "/" + document_name):
+            jobs[str(output_path)] = (document_name, start_time, end_time, directory, 1)
+
+    scheduled = snippet_prefetcher.schedule_batch(jobs, _render_snippet)
+    if scheduled:
+        logger.info(f"Prefetching {scheduled} video chunks")
+    return scheduled
 
 def ingest_data_tool(directory: str) -> str:
     try:
@@ -134,10 +363,11 @@ def ingest_data_tool(directory: str) -> str:
         logger.error(f"Failed to load data: {str(e)}")
         return f"Failed to load data: {str(e)}"
 
-def retrieve_data_tool(query: str) -> Any:
+def retrieve_data_tool(query: str, document_names: Optional[List[str]] = None, top_k: Optional[int] = None,
+                       min_score: Optional[float] = None, fields: Optional[List[str]] = None) -> Any:
     try:
         logger.info(f"Retrieving data for query: {query}")
-        return retrieve_data(query)
+        return retrieve_data(query, document_names=document_names, top_k=top_k, min_score=min_score, fields=fields)
     except Exception as e:
         logger.error(f"Failed to retrieve data: {str(e)}")
         return {"error": f"Failed to retrieve data: {str(e)}"}
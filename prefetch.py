@@ -0,0 +1,85 @@
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _lower_priority(niceness: int) -> None:
+    # Niceness is per thread on Linux and inherited by the ffmpeg processes the thread spawns
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+def cpu_is_busy(max_load: float) -> bool:
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1) > max_load
+    except (AttributeError, OSError):
+        return False
+
+
+class SnippetPrefetcher:
+    """
+    Low-priority background pool for speculative work keyed by its output (e.g. a snippet path).
+
+    Each `schedule_batch` cancels whatever the previous batch left queued, so only the
+    latest retrieval's results are speculated on. `wait` lets a foreground request take
+    over a key: it cancels the job if still queued, or waits for it if already running.
+    """
+
+    def __init__(self, max_workers: int = 1, niceness: int = 10):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="snippet-prefetch",
+            initializer=_lower_priority,
+            initargs=(niceness,),
+        )
+        self._pending: Dict[str, Future] = {}
+        # Re-entrant: cancelling a future runs its done callback, which takes the lock again
+        self._lock = threading.RLock()
+
+    def schedule_batch(self, jobs: Dict[str, tuple], fn: Callable[..., Any]) -> int:
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in jobs:
+                    future.cancel()
+            scheduled = 0
+            for key, args in jobs.items():
+                if key in self._pending:
+                    continue
+                future = self._executor.submit(fn, *args)
+                self._pending[key] = future
+                future.add_done_callback(lambda f, key=key: self._finished(key, f))
+                scheduled += 1
+        return scheduled
+
+    def _finished(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Prefetch of {key} failed: {str(future.exception())}")
+
+    def wait(self, key: str, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None or future.cancel():
+            return
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            # The foreground request renders it again and surfaces its own error
+            pass
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
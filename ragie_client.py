@@ -0,0 +1,264 @@
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a document will not change any more
+READY_STATUS = "ready"
+FAILED_STATUSES = {"failed"}
+
+# HTTP statuses worth retrying; everything else is a caller error
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Methods that change server state: after a timeout or 5xx the server may already have
+# applied them, so they are only retried on 429 or when the request never reached it
+NON_IDEMPOTENT_PREFIXES = ("create", "update", "patch", "delete")
+# Methods that may send a whole video body and get their own timeout
+UPLOAD_PREFIXES = ("create", "update")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Ragie while the circuit breaker is open."""
+
+
+class DocumentProcessingError(Exception):
+    """Raised when a document reaches a failed terminal status."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and status > 0:
+        return status
+    raw = getattr(exc, "raw_response", None)
+    status = getattr(raw, "status_code", None)
+    if isinstance(status, int):
+        return status
+    # ragie.models.ErrorMessage carries 400/401/402/429 without the status code
+    message = str(exc).lower()
+    if "rate limit" in message or "too many requests" in message:
+        return 429
+    return None
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+        if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+    except ImportError:
+        pass
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    if isinstance(exc, TimeoutError):
+        return True
+    try:
+        import httpx
+        return isinstance(exc, httpx.TimeoutException)
+    except ImportError:
+        return False
+
+
+def _never_sent(exc: BaseException) -> bool:
+    if isinstance(exc, ConnectionRefusedError):
+        return True
+    try:
+        import httpx
+        # Connection setup failed, so no request bytes reached the server
+        return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+    except ImportError:
+        return False
+
+
+def _is_congestion(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    return status == 429 or (status is not None and status >= 500) or _is_timeout(exc)
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    raw = getattr(exc, "raw_response", None)
+    headers = getattr(raw, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by ~1 per window of successes, halves on congestion."""
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                raise TimeoutError("Timed out waiting for a Ragie request slot")
+            self.in_flight += 1
+
+    def release(self, congested: Optional[bool] = None) -> None:
+        # congested=None releases the slot without feeding a signal into the limit
+        with self._cond:
+            self.in_flight -= 1
+            if congested:
+                self.limit = max(float(self.minimum), self.limit / 2)
+                logger.warning(f"Ragie congestion detected, concurrency limit lowered to {int(self.limit)}")
+            elif congested is not None:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through after the reset timeout."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return
+            raise CircuitOpenError("Ragie circuit breaker is open; failing fast")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.error(f"Ragie circuit breaker opened after {self._failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class _ResourceProxy:
+    def __init__(self, owner: "ResilientRagie", target: Any, name: str):
+        self._owner = owner
+        self._target = target
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._target, attr)
+        name = f"{self._name}.{attr}"
+        if callable(value):
+            return lambda *args, **kwargs: self._owner.call(value, *args, _operation=name, **kwargs)
+        return _ResourceProxy(self._owner, value, name)
+
+
+class ResilientRagie:
+    """
+    Wraps a Ragie client so that every `client.<resource>.<method>(...)` call gets a
+    per-call timeout, retries with exponential backoff and full jitter, an AIMD
+    concurrency limit driven by 429s and latency, and a shared circuit breaker.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        timeout_ms: int = 60_000,
+        upload_timeout_ms: Optional[int] = None,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 20.0,
+        latency_factor: float = 3.0,
+        limiter: Optional[AdaptiveLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self._client = client
+        self.timeout_ms = timeout_ms
+        self.upload_timeout_ms = upload_timeout_ms
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.latency_factor = latency_factor
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return _ResourceProxy(self, getattr(self._client, name), name)
+
+    def _is_slow(self, operation: str, elapsed: float) -> bool:
+        # Compare against an EWMA per operation so slow uploads do not look like congestion
+        with self._latency_lock:
+            average, samples = self._latency.get(operation, (elapsed, 0))
+            slow = samples >= 5 and elapsed > self.latency_factor * average
+            self._latency[operation] = (0.8 * average + 0.2 * elapsed, samples + 1)
+        return slow
+
+    def call(self, fn: Callable[..., Any], *args: Any, _operation: str = "call", **kwargs: Any) -> Any:
+        with span(f"ragie.{_operation}"):
+            return self._call_with_retries(fn, args, kwargs, _operation)
+
+    def _can_retry(self, operation: str, exc: BaseException) -> bool:
+        if not is_transient(exc):
+            return False
+        method = operation.rsplit(".", 1)[-1]
+        if method.startswith(NON_IDEMPOTENT_PREFIXES):
+            return _status_code(exc) == 429 or _never_sent(exc)
+        return True
+
+    def _call_with_retries(self, fn: Callable[..., Any], args: tuple, kwargs: dict, _operation: str) -> Any:
+        method = _operation.rsplit(".", 1)[-1]
+        # None leaves the request without a timeout
+        kwargs.setdefault("timeout_ms", self.upload_timeout_ms if method.startswith(UPLOAD_PREFIXES) else self.timeout_ms)
+        attempt = 0
+        while True:
+            self.limiter.acquire(timeout=self.timeout_ms / 1000)
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.limiter.release()
+                raise
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                # Only overload signals shrink the limit; other failures leave it unchanged
+                self.limiter.release(congested=True if _is_congestion(e) else None)
+                if not is_transient(e):
+                    # The service answered, it just rejected this request
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not self._can_retry(_operation, e):
+                    logger.error(f"Ragie {_operation} failed and is not safe to retry: {str(e)}")
+                    raise
+                if attempt >= self.max_retries:
+                    logger.error(f"Ragie {_operation} failed after {attempt + 1} attempts: {str(e)}")
+                    raise
+                delay = _retry_after(e) or random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                logger.warning(f"Ragie {_operation} failed ({str(e)}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.limiter.release(congested=self._is_slow(_operation, time.monotonic() - started))
+            self.breaker.record_success()
+            return result
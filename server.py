@@ -1,16 +1,20 @@
 from mcp.server.fastmcp import FastMCP
-from main import clear_index, ingest_data, retrieve_data, chunk_video
-from typing import Any
+from main import clear_index, ingest_data, retrieve_data, chunk_video, chunk_video_ranges, lookup_chunks, prefetch_snippets
+from interval_index import parse_timestamp
+from tracing import span, traced
+from typing import Any, List, Optional, Union
 import requests
 from collections import Counter
 import re
 import cv2
 import numpy as np
 import json
+import time
 
 mcp = FastMCP("ragie")
 
 @mcp.tool()
+@traced()
 def ingest_data_tool(directory: str) -> str:
     """
     Loads data from a directory into the Ragie index. Wait until the data is fully ingested before continuing.
@@ -29,7 +33,10 @@ def ingest_data_tool(directory: str) -> str:
         return f"Failed to load data: {str(e)}"
 
 @mcp.tool()
-def retrieve_data_tool(query: str) -> Any:
+@traced()
+def retrieve_data_tool(query: str, document_names: Optional[List[str]] = None, top_k: Optional[int] = None,
+                       min_score: Optional[float] = None, fields: Optional[List[str]] = None,
+                       prefetch: Optional[int] = None) -> Any:
     """
     Retrieves data from the Ragie index based on the query. The data is returned as a list of dictionaries, each containing the following keys:
     - text: The text of the retrieved chunk
@@ -39,16 +46,24 @@ def retrieve_data_tool(query: str) -> Any:
 
     Args:
         query (str): The query to retrieve data from the Ragie index.
+        document_names (list[str], optional): Only retrieve chunks from these documents.
+        top_k (int, optional): Maximum number of chunks to retrieve.
+        min_score (float, optional): Drop chunks scoring below this value.
+        fields (list[str], optional): Only return these keys for each chunk (e.g. text, document_name, score, start_time, end_time).
+        prefetch (int, optional): Render video chunks for this many top results in the background so a following show_video_tool call is served from disk (defaults to SNIPPET_PREFETCH_TOP_N, 0 disables).
 
     Returns:
         list[dict]: The retrieved data or error message.
     """
     try:
-        return retrieve_data(query)
+        chunks = retrieve_data(query, document_names=document_names, top_k=top_k, min_score=min_score, fields=fields)
+        prefetch_snippets(chunks, top_n=prefetch)
+        return chunks
     except Exception as e:
         return {"error": f"Failed to retrieve data: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def show_video_tool(document_name: str, start_time: float, end_time: float) -> str:
     """
     Creates and saves a video chunk based on the document name, start time, and end time of the chunk.
@@ -68,6 +83,52 @@ def show_video_tool(document_name: str, start_time: float, end_time: float) -> s
     except Exception as e:
         return f"Failed to create video chunk: {str(e)}"
 
+@mcp.tool()
+@traced()
+def show_video_ranges_tool(document_name: str, ranges: List[List[float]], merge: bool = True, merge_gap: float = 1.0) -> Any:
+    """
+    Creates video chunks for several [start_time, end_time] ranges of one document, e.g. all chunks returned by a retrieval.
+    Overlapping ranges, and ranges less than merge_gap seconds apart, are merged into a single clip first.
+
+    Args:
+        document_name (str): The name of the document the chunks belong to
+        ranges (list[list[float]]): The [start_time, end_time] pairs to render
+        merge (bool): Whether to merge overlapping or near-adjacent ranges (default True)
+        merge_gap (float): Maximum gap in seconds between ranges that are merged (default 1.0)
+
+    Returns:
+        list[dict]: The start_time, end_time and path of each created chunk, or error message.
+    """
+    try:
+        return chunk_video_ranges(document_name, [(start, end) for start, end in ranges], merge=merge, merge_gap=merge_gap)
+    except Exception as e:
+        return {"error": f"Failed to create video chunks: {str(e)}"}
+
+@mcp.tool()
+@traced()
+def lookup_timestamp_tool(document_name: str, timestamp: Union[float, str], end_time: Optional[Union[float, str]] = None) -> Any:
+    """
+    Returns the chunks of a video at a timestamp, e.g. to answer "what was said at 12:30?".
+    If end_time is given, returns every chunk overlapping the range instead.
+
+    Args:
+        document_name (str): The name of the document.
+        timestamp (float | str): Seconds (e.g. 750) or "[hh:]mm:ss" (e.g. "12:30").
+        end_time (float | str, optional): End of the range, in the same format.
+
+    Returns:
+        list[dict]: The matching chunks with text, document_name, start_time and end_time, or error message.
+    """
+    try:
+        start = parse_timestamp(timestamp)
+        end = parse_timestamp(end_time) if end_time is not None else None
+    except ValueError as e:
+        return {"error": str(e)}
+    try:
+        return lookup_chunks(document_name, start, end)
+    except Exception as e:
+        return {"error": f"Failed to look up timestamp: {str(e)}"}
+
 def format_transcript(transcript):
     # Split on } { to handle multiple JSON objects in a single string
     transcript = transcript.replace('} {', '}|||{')
@@ -85,6 +146,7 @@ def format_transcript(transcript):
     return ('\n' + '='*60 + '\n').join(formatted_chunks)
 
 @mcp.tool()
+@traced()
 def get_transcript_tool(document_name: str) -> dict:
     """
     Returns the transcript for the given video document, formatted for readability.
@@ -94,14 +156,16 @@ def get_transcript_tool(document_name: str) -> dict:
         dict: The formatted transcript.
     """
     try:
-        chunks = retrieve_data(document_name)
-        transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
-        formatted = format_transcript(transcript)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
+        with span("transcript.assemble", chunks=len(chunks)):
+            transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
+            formatted = format_transcript(transcript)
         return {"transcript": formatted}
     except Exception as e:
         return {"error": f"Failed to get transcript: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def get_highlights_tool(document_name: str) -> dict:
     """
     Returns highlights for the given video document.
@@ -111,13 +175,14 @@ def get_highlights_tool(document_name: str) -> dict:
         dict: The highlights.
     """
     try:
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         highlights = [chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name and chunk.get("text")] [:3]
         return {"highlights": highlights}
     except Exception as e:
         return {"error": f"Failed to get highlights: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def get_analytics_tool(document_name: str) -> dict:
     """
     Returns analytics for the given video document.
@@ -127,27 +192,29 @@ def get_analytics_tool(document_name: str) -> dict:
         dict: The analytics.
     """
     try:
-        chunks = retrieve_data(document_name)
-        chunk_texts = [c.get("text", "") for c in chunks if c.get("document_name") == document_name]
-        transcript = " ".join(chunk_texts)
-        words = re.findall(r"\w+", transcript.lower())
-        stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
-        non_stopwords = [w for w in words if w not in stopwords]
-        most_common_words = [w for w, _ in Counter(non_stopwords).most_common(5)]
-        num_highlights = min(3, len([t for t in chunk_texts if t]))
-        duration_min = round(len(words) / 150, 2) if words else 0
-        analytics = {
-            "num_chunks": len(chunk_texts),
-            "total_length": sum(len(t) for t in chunk_texts),
-            "duration_minutes": duration_min,
-            "most_common_words": most_common_words,
-            "num_highlights": num_highlights
-        }
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
+        with span("analytics", chunks=len(chunks)):
+            chunk_texts = [c.get("text", "") for c in chunks if c.get("document_name") == document_name]
+            transcript = " ".join(chunk_texts)
+            words = re.findall(r"\w+", transcript.lower())
+            stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
+            non_stopwords = [w for w in words if w not in stopwords]
+            most_common_words = [w for w, _ in Counter(non_stopwords).most_common(5)]
+            num_highlights = min(3, len([t for t in chunk_texts if t]))
+            duration_min = round(len(words) / 150, 2) if words else 0
+            analytics = {
+                "num_chunks": len(chunk_texts),
+                "total_length": sum(len(t) for t in chunk_texts),
+                "duration_minutes": duration_min,
+                "most_common_words": most_common_words,
+                "num_highlights": num_highlights
+            }
         return {"analytics": analytics}
     except Exception as e:
         return {"error": f"Failed to get analytics: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def image_search_tool(image_path: str, video_path: str, threshold: float = 0.8, frame_interval: float = 0.5) -> dict:
     """
     Searches for the given image in the specified video file using template matching.
@@ -170,23 +237,37 @@ def image_search_tool(image_path: str, video_path: str, threshold: float = 0.8,
         fps = cap.get(cv2.CAP_PROP_FPS)
         matches = []
         frame_count = 0
-        while True:
-            pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if frame_count % int(frame_interval * fps) == 0:
-                res = cv2.matchTemplate(frame, img, cv2.TM_CCOEFF_NORMED)
-                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-                if max_val >= threshold:
-                    matches.append(pos_msec / 1000.0)  # seconds
-            frame_count += 1
-        cap.release()
+        # Per-frame spans would flood the trace, so decode and match time are accumulated into one
+        decode_seconds = 0.0
+        match_seconds = 0.0
+        with span("image_search.scan", video_path=video_path) as record:
+            while True:
+                started = time.perf_counter()
+                pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+                ret, frame = cap.read()
+                decode_seconds += time.perf_counter() - started
+                if not ret:
+                    break
+                if frame_count % int(frame_interval * fps) == 0:
+                    started = time.perf_counter()
+                    res = cv2.matchTemplate(frame, img, cv2.TM_CCOEFF_NORMED)
+                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+                    match_seconds += time.perf_counter() - started
+                    if max_val >= threshold:
+                        matches.append(pos_msec / 1000.0)  # seconds
+                frame_count += 1
+            cap.release()
+            record["attributes"].update({
+                "frames": frame_count,
+                "decode_ms": round(decode_seconds * 1000, 3),
+                "match_ms": round(match_seconds * 1000, 3),
+            })
         return {"matches": matches}
     except Exception as e:
         return {"error": f"Failed to search by image: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def get_tags_chapters_tool(document_name: str) -> dict:
     """
     Returns tags and chapters for the given video document.
@@ -196,7 +277,7 @@ def get_tags_chapters_tool(document_name: str) -> dict:
         dict: The tags and chapters.
     """
     try:
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         stopwords = set(["the", "and", "a", "to", "of", "in", "is", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "from", "or", "are", "was", "but", "not", "have", "has", "had", "they", "you", "we", "he", "she", "his", "her", "their", "our", "its", "which", "who", "what", "when", "where", "how", "why"])
         all_text = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
         words = re.findall(r"\w+", all_text.lower())
@@ -211,6 +292,7 @@ def get_tags_chapters_tool(document_name: str) -> dict:
         return {"error": f"Failed to get tags/chapters: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def get_languages_tool() -> dict:
     """
     Returns supported languages.
@@ -224,9 +306,10 @@ def get_languages_tool() -> dict:
         return {"error": f"Failed to get languages: {str(e)}"}
 
 @mcp.tool()
+@traced()
 def translate_transcript_tool(document_name: str, target_language: str) -> dict:
     try:
-        chunks = retrieve_data(document_name)
+        chunks = retrieve_data(document_name, document_names=[document_name], fields=["text", "document_name"])
         transcript = " ".join(chunk.get("text", "") for chunk in chunks if chunk.get("document_name") == document_name)
         response = requests.post(
             "http://localhost:5000/translate",
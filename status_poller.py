@@ -0,0 +1,199 @@
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from ragie_client import READY_STATUS, FAILED_STATUSES, CircuitOpenError, DocumentProcessingError, is_transient
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    def __init__(self, document_id: str, document_name: Optional[str], file_size: int, timeout: float):
+        self.document_id = document_id
+        self.document_name = document_name
+        self.file_size = file_size
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.next_check = self.started
+        self.status = None
+        self.future: Future = Future()
+
+
+class DocumentStatusPoller:
+    """
+    Single background poller for every document still being processed by Ragie.
+
+    Callers `track` a document and get a Future resolved with the document once it is
+    ready (or failed with DocumentProcessingError / TimeoutError). Due documents are
+    checked together with one filtered `documents.list` call on their names, falling
+    back to `documents.get` for any the list did not return. Each document's interval
+    grows with the time it has been processing and starts longer for larger files.
+
+    With `webhook=True` statuses are expected through `notify` (called from the Ragie
+    webhook endpoint), so documents are only polled every `max_interval` as a fallback
+    for missed webhooks. Once a webhook reports a document ready it is polled at the
+    normal interval until a fetch confirms it, since that fetch may briefly lag.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        min_interval: float = 2.0,
+        max_interval: float = 30.0,
+        timeout: float = 1800.0,
+        webhook: bool = False,
+    ):
+        self._client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.webhook = webhook
+        self._pending: Dict[str, _Pending] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _interval(self, entry: _Pending) -> float:
+        # Poll at ~20% of the elapsed processing time; a 100 MB file starts at twice the minimum interval
+        elapsed = time.monotonic() - entry.started
+        size_factor = 1 + entry.file_size / 100_000_000
+        return min(self.max_interval, max(self.min_interval * size_factor, elapsed * 0.2))
+
+    def _next_interval(self, entry: _Pending) -> float:
+        # Webhook mode only falls back to slow polling until a webhook reports the document ready
+        if self.webhook and entry.status != READY_STATUS:
+            return self.max_interval
+        return self._interval(entry)
+
+    def track(
+        self,
+        document_id: str,
+        document_name: Optional[str] = None,
+        file_size: int = 0,
+        timeout: Optional[float] = None,
+        callback: Optional[Callable[[Future], None]] = None,
+    ) -> Future:
+        with self._cond:
+            entry = self._pending.get(document_id)
+            if entry is None:
+                entry = _Pending(document_id, document_name, file_size, timeout or self.timeout)
+                entry.next_check = entry.started + self._next_interval(entry)
+                self._pending[document_id] = entry
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="ragie-status-poller", daemon=True)
+                    self._thread.start()
+                self._cond.notify_all()
+        if callback is not None:
+            entry.future.add_done_callback(callback)
+        return entry.future
+
+    def wait(self, document_id: str, **kwargs: Any) -> Any:
+        return self.track(document_id, **kwargs).result()
+
+    def notify(self, document_id: str, status: str) -> bool:
+        """Record a status pushed by Ragie. Returns False for documents that are not being tracked."""
+        with self._cond:
+            entry = self._pending.get(document_id)
+            if entry is None:
+                return False
+            if status == READY_STATUS:
+                # The webhook only carries the status, so fetch the document it resolves with
+                entry.next_check = time.monotonic()
+                entry.status = status
+                self._cond.notify_all()
+                return True
+        self._update(entry, status)
+        return True
+
+    def _update(self, entry: _Pending, status: str, document: Any = None) -> None:
+        if status == READY_STATUS and document is not None:
+            self._resolve(entry, result=document)
+        elif status in FAILED_STATUSES:
+            self._resolve(entry, error=DocumentProcessingError(f"Document {entry.document_id} ended in status '{status}'"))
+        elif status != entry.status and entry.status != READY_STATUS:
+            # A ready webhook is kept even if a lagging fetch still reports an earlier status
+            logger.info(f"Document {entry.document_id} is {status}")
+            entry.status = status
+
+    def _resolve(self, entry: _Pending, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            if self._pending.get(entry.document_id) is entry:
+                del self._pending[entry.document_id]
+        if entry.future.done():
+            return
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
+
+    def _due(self) -> list:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = []
+                wake_at = None
+                for entry in self._pending.values():
+                    if now >= entry.deadline:
+                        due.append(entry)
+                        continue
+                    check_at = min(entry.next_check, entry.deadline)
+                    if now >= check_at:
+                        due.append(entry)
+                    else:
+                        wake_at = check_at if wake_at is None else min(wake_at, check_at)
+                if due:
+                    return due
+                self._cond.wait(timeout=None if wake_at is None else wake_at - now)
+
+    def _run(self) -> None:
+        while True:
+            due = self._due()
+            now = time.monotonic()
+            for entry in [e for e in due if now >= e.deadline]:
+                self._resolve(entry, error=TimeoutError(
+                    f"Document {entry.document_id} not ready after {entry.deadline - entry.started:.1f}s (status '{entry.status}')"
+                ))
+            due = [e for e in due if now < e.deadline]
+            if not due:
+                continue
+            with span("ingest.poll_batch", documents=len(due)):
+                self._check(due)
+            with self._cond:
+                for entry in due:
+                    entry.next_check = time.monotonic() + self._next_interval(entry)
+
+    def _check(self, entries: list) -> None:
+        remaining = {entry.document_id: entry for entry in entries}
+        names = sorted({entry.document_name for entry in entries if entry.document_name})
+        cursor = None
+        try:
+            while names and remaining:
+                request = {"filter": json.dumps({"document_name": {"$in": names}}), "page_size": 100}
+                if cursor:
+                    request["cursor"] = cursor
+                response = self._client.documents.list(request=request)
+                for document in response.result.documents:
+                    entry = remaining.pop(document.id, None)
+                    if entry is not None:
+                        self._update(entry, document.status, document)
+                cursor = response.result.pagination.next_cursor
+                if not cursor:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to list status of {len(remaining)} documents, checking them one by one: {str(e)}")
+        # Documents the batched list did not cover are fetched one by one
+        for entry in list(remaining.values()):
+            try:
+                document = self._client.documents.get(document_id=entry.document_id)
+            except Exception as e:
+                if isinstance(e, CircuitOpenError) or is_transient(e):
+                    # Retried by the client already; check again next round until the deadline
+                    logger.error(f"Failed to check status of document {entry.document_id}: {str(e)}")
+                else:
+                    # e.g. a 404 after the document was deleted: it will never become ready
+                    self._resolve(entry, error=e)
+                continue
+            self._update(entry, document.status, document)
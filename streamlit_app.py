@@ -80,7 +80,7 @@ if selected_video and selected_video != "No videos found":
     elif tool == "Query":
         query = st.text_input("Enter your query about the video")
         if st.button("Run Query") and query:
-            result = retrieve_data_tool(query)
+            result = retrieve_data_tool(query, document_names=[selected_video])
             st.subheader("Query Results")
             st.write(result)
 else:
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Spans are appended to TRACE_FILE as JSON lines; tracing is a no-op when it is unset
+TRACE_FILE = os.getenv("TRACE_FILE")
+# Per-request profiles are written here as .prof files (open with pstats or snakeviz)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Profile every request/tool call, not only those sending the X-Profile header
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "").lower() in ("1", "true", "yes")
+
+_current_span: ContextVar[Optional[dict]] = ContextVar("current_span", default=None)
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+_export_lock = threading.Lock()
+
+
+def _export(record: dict) -> None:
+    line = json.dumps(record, default=str)
+    with _export_lock:
+        with open(TRACE_FILE, "a") as f:
+            f.write(line + "\n")
+
+
+class RequestProfile:
+    """
+    cProfile capture for one request. cProfile only sees the thread it is enabled in,
+    so every span entered on a new thread while the profile is current (e.g. a sync
+    endpoint in the threadpool) enables a profiler for that thread, and the stats of
+    all threads are merged when the profile is dumped.
+
+    A profiler records everything its thread runs, not just this request: on the
+    event-loop thread that includes any other coroutines that run while the request
+    awaits. Only one profiler can own a thread, so a request overlapping another
+    profiled request on the same thread gets no profile for that thread (and none at
+    all if it never leaves it).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._profilers = []
+        self._active_threads = set()
+        self._lock = threading.Lock()
+
+    def start_thread(self) -> Optional[cProfile.Profile]:
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id in self._active_threads:
+                return None
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler already owns this thread
+                return None
+            self._active_threads.add(thread_id)
+            self._profilers.append(profiler)
+            return profiler
+
+    def stop_thread(self, profiler: cProfile.Profile) -> None:
+        profiler.disable()
+        with self._lock:
+            self._active_threads.discard(threading.get_ident())
+
+    def dump(self) -> Optional[Path]:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        output_dir = Path(PROFILE_DIR)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in self.name).strip("_")
+        output_path = output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_name}_{uuid.uuid4().hex[:8]}.prof"
+        pstats.Stats(*profilers).dump_stats(str(output_path))
+        logger.info(f"Wrote profile for {self.name} to {output_path}")
+        return output_path
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """
+    Time a stage. Nested spans share the trace id of the outermost one; callers may
+    add attributes to the yielded record before the span ends.
+    """
+    profile = _current_profile.get()
+    profiler = profile.start_thread() if profile is not None else None
+    parent = _current_span.get()
+    record = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "thread": threading.current_thread().name,
+        "attributes": attributes,
+    }
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _current_span.reset(token)
+        if profiler is not None:
+            profile.stop_thread(profiler)
+        if TRACE_FILE:
+            try:
+                _export(record)
+            except OSError as e:
+                logger.warning(f"Failed to export span {name}: {str(e)}")
+
+
+def profiling_requested(flag: Optional[str] = None) -> bool:
+    return PROFILE_REQUESTS or (flag or "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def request_scope(name: str, profile: bool = False, **attributes: Any):
+    """Root span for a request or tool call, optionally capturing a cProfile of everything beneath it."""
+    request_profile = RequestProfile(name) if profile else None
+    token = _current_profile.set(request_profile) if request_profile is not None else None
+    with span(name, **attributes) as record:
+        try:
+            yield record
+        finally:
+            if token is not None:
+                _current_profile.reset(token)
+                # Dump before the root span ends so its exported record points at the profile
+                try:
+                    profile_path = request_profile.dump()
+                    if profile_path is not None:
+                        record["attributes"]["profile"] = str(profile_path)
+                    else:
+                        logger.warning(f"No profile captured for {name}: another profiler owned its thread")
+                except Exception as e:
+                    logger.warning(f"Failed to write profile for {name}: {str(e)}")
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator running a tool call in its own request scope (profiled when PROFILE_REQUESTS is set)."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_scope(name or fn.__name__, profile=profiling_requested()):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator